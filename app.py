@@ -18,6 +18,7 @@ from src.fetch_refs import download_refs
 from src.llm_groq import analyze_doc_with_citations as groq_analyze, DEFAULT_MODEL as GROQ_DEFAULT
 from src.llm_gemini import analyze_doc_with_citations as gemini_analyze, DEFAULT_MODEL as GEMINI_DEFAULT
 from src.demo_samples import generate_samples
+from src.prompt_builder import DEFAULT_INPUT_BUDGET, UsageRecord, usage_summary
 
 
 def main() -> None:
@@ -60,6 +61,8 @@ def main() -> None:
         else:
             model_name = ""
         temperature = st.slider("LLM temperature", 0.0, 1.0, 0.2)
+        input_budget = st.slider("LLM input token budget", 1000, 16000, DEFAULT_INPUT_BUDGET, step=500)
+        st.caption("A larger budget sends more of each document to the model; input cost grows with it.")
 
         st.header("Demo")
         if st.button("Generate sample .docx files"):
@@ -90,6 +93,7 @@ def main() -> None:
         return
 
     doc_entries = []
+    run_usage: List[UsageRecord] = []
     for f in uploaded_files:
         content = f.read()
         text = extract_text(content)
@@ -117,9 +121,25 @@ def main() -> None:
                 ]
             try:
                 if provider == "Groq":
-                    llm_issues = groq_analyze(text, seed_ctx, model=model_name, temperature=temperature, api_key=groq_key)
+                    llm_issues = groq_analyze(
+                        text,
+                        seed_ctx,
+                        model=model_name,
+                        temperature=temperature,
+                        api_key=groq_key,
+                        usage=run_usage,
+                        max_input_tokens=input_budget,
+                    )
                 else:
-                    llm_issues = gemini_analyze(text, seed_ctx, model=model_name, temperature=temperature, api_key=gemini_key)
+                    llm_issues = gemini_analyze(
+                        text,
+                        seed_ctx,
+                        model=model_name,
+                        temperature=temperature,
+                        api_key=gemini_key,
+                        usage=run_usage,
+                        max_input_tokens=input_budget,
+                    )
                 # Merge unique issues
                 existing = {(i.get("issue"), i.get("suggestion")) for i in issues}
                 for li in llm_issues:
@@ -165,6 +185,10 @@ def main() -> None:
             else:
                 st.json(d["issues"])
 
+    if run_usage:
+        st.subheader("LLM Usage")
+        st.json(usage_summary(run_usage))
+
     # Build a consolidated report
     report = build_report(process, doc_entries, required)
 
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import os
+import time
 from typing import List, Dict, Any, Optional
 
 import google.generativeai as genai
 
+from .prompt_builder import DEFAULT_INPUT_BUDGET, UsageRecord, build_prompt, record_usage
+
 
 DEFAULT_MODEL = "models/gemini-1.5-pro"
 
@@ -22,24 +25,41 @@ def analyze_doc_with_citations(
     model: str = DEFAULT_MODEL,
     temperature: float = 0.2,
     api_key: Optional[str] = None,
+    usage: List[UsageRecord] | None = None,
+    max_input_tokens: int = DEFAULT_INPUT_BUDGET,
 ) -> List[Dict[str, Any]]:
     """Ask Gemini to find issues and suggestions, optionally grounded by citations.
 
-    Returns a list of {issue, severity, suggestion, section?} dicts.
+    Returns a list of {issue, severity, suggestion, section?} dicts. Token usage for the
+    call is appended to ``usage`` when a list is passed.
     """
     get_client(api_key)
-    sys_prompt = (
-        "You are an ADGM compliance assistant. Analyze the document text for red flags "
-        "(jurisdiction, missing clauses, ambiguity, signatures) and propose concise suggestions. "
-        "Return a compact JSON array in an object with key 'issues', and each issue has keys: issue, severity (High/Medium/Low), suggestion, section."
+    prompt = build_prompt(text, citations, model=model, max_input_tokens=max_input_tokens)
+
+    # Context caching is not used: CachedContent needs a 32k-token prefix and the only
+    # fixed part of this prompt is the short system instruction.
+    model_ref = genai.GenerativeModel(model, system_instruction=prompt.system)
+    started = time.perf_counter()
+    resp = model_ref.generate_content(
+        prompt.user,
+        generation_config={
+            "temperature": temperature,
+            "max_output_tokens": prompt.max_output_tokens,
+            "response_mime_type": "application/json",
+        },
     )
-    context_block = "\n\nCitations (optional):\n" + "\n".join(
-        f"- Source: {c.get('source','')}\n  Snippet: {c.get('snippet','')[:300]}" for c in (citations or [])
+    reported = getattr(resp, "usage_metadata", None)
+    record_usage(
+        "gemini",
+        prompt,
+        getattr(reported, "prompt_token_count", None),
+        getattr(reported, "candidates_token_count", None),
+        latency_s=time.perf_counter() - started,
+        usage=usage,
     )
-    user_prompt = f"{sys_prompt}\n\nDocument text (truncated to 8k chars):\n{text[:8000]}{context_block}\n\nRespond with JSON only."
-
-    model_ref = genai.GenerativeModel(model)
-    resp = model_ref.generate_content(user_prompt, generation_config={"temperature": temperature})
+    finish = resp.candidates[0].finish_reason if resp.candidates else None
+    if getattr(finish, "name", finish) == "MAX_TOKENS":
+        raise RuntimeError(f"Gemini response truncated at {prompt.max_output_tokens} output tokens")
     content = resp.text or "{}"
     import json
     try:
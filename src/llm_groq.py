@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import os
+import time
 from typing import List, Dict, Any, Optional
 
 from groq import Groq
 
+from .prompt_builder import DEFAULT_INPUT_BUDGET, UsageRecord, build_prompt, record_usage
+
 
 DEFAULT_MODEL = "llama-3.3-70b-versatile"
 
@@ -22,32 +25,41 @@ def analyze_doc_with_citations(
     model: str = DEFAULT_MODEL,
     temperature: float = 0.2,
     api_key: Optional[str] = None,
+    usage: List[UsageRecord] | None = None,
+    max_input_tokens: int = DEFAULT_INPUT_BUDGET,
 ) -> List[Dict[str, Any]]:
     """Ask Groq LLM to find issues and suggestions, optionally grounded by citations.
 
-    Returns a list of {issue, severity, suggestion, section?} dicts.
+    Returns a list of {issue, severity, suggestion, section?} dicts. Token usage for the
+    call is appended to ``usage`` when a list is passed.
     """
     client = get_client(api_key)
-    sys_prompt = (
-        "You are an ADGM compliance assistant. Analyze the document text for red flags "
-        "(jurisdiction, missing clauses, ambiguity, signatures) and propose concise suggestions. "
-        "Return a compact JSON array of objects with keys: issue, severity (High/Medium/Low), suggestion, section."
-    )
-    context_block = "\n\nCitations (optional):\n" + "\n".join(
-        f"- Source: {c.get('source','')}\n  Snippet: {c.get('snippet','')[:300]}" for c in (citations or [])
-    )
-    user_prompt = f"Document text (truncated to 8k chars):\n{text[:8000]}{context_block}\n\nRespond with JSON only."
+    prompt = build_prompt(text, citations, model=model, max_input_tokens=max_input_tokens)
 
+    started = time.perf_counter()
     completion = client.chat.completions.create(
         model=model,
         messages=[
-            {"role": "system", "content": sys_prompt},
-            {"role": "user", "content": user_prompt},
+            {"role": "system", "content": prompt.system},
+            {"role": "user", "content": prompt.user},
         ],
         temperature=temperature,
+        max_tokens=prompt.max_output_tokens,
         response_format={"type": "json_object"},
     )
-    content = completion.choices[0].message.content or "{}"
+    reported = getattr(completion, "usage", None)
+    record_usage(
+        "groq",
+        prompt,
+        getattr(reported, "prompt_tokens", None),
+        getattr(reported, "completion_tokens", None),
+        latency_s=time.perf_counter() - started,
+        usage=usage,
+    )
+    choice = completion.choices[0]
+    if choice.finish_reason == "length":
+        raise RuntimeError(f"Groq response truncated at {prompt.max_output_tokens} output tokens")
+    content = choice.message.content or "{}"
     # The model is asked to return an object with key 'issues'
     import json
     try:
@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import math
+import re
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional, Tuple
+
+from .document_parser import split_into_sections
+
+
+SYSTEM_PROMPT = (
+    "You are an ADGM compliance assistant. Analyze the document text for red flags "
+    "(jurisdiction, missing clauses, ambiguity, signatures) and propose concise suggestions. "
+    "Return a compact JSON object with key 'issues' holding an array of objects with keys: "
+    "issue, severity (High/Medium/Low), suggestion, section."
+)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Token limits, list prices (USD per 1M tokens) and tokenizer calibration for a model.
+
+    ``word_chars`` is the average number of word characters one token covers and
+    ``digits_per_token`` how many digits the tokenizer groups; both feed the local estimate.
+    """
+
+    context_window: int
+    max_output_tokens: int
+    input_price: float
+    output_price: float
+    word_chars: float = 4.0
+    digits_per_token: int = 1
+
+
+# Tokenizer families, calibrated so the estimate matches each family's published average
+# characters per token on English legal text (Llama 3 ~4.2, Gemini/Gemma ~4.0, Mixtral ~3.5).
+_LLAMA3 = {"word_chars": 5.5, "digits_per_token": 3}
+_GEMINI = {"word_chars": 5.0, "digits_per_token": 1}
+_MIXTRAL = {"word_chars": 4.0, "digits_per_token": 1}
+
+MODEL_SPECS: Dict[str, ModelSpec] = {
+    "llama-3.3-70b-versatile": ModelSpec(131072, 32768, 0.59, 0.79, **_LLAMA3),
+    "llama-3.1-70b-versatile": ModelSpec(131072, 8000, 0.59, 0.79, **_LLAMA3),
+    "llama-3.1-8b-instant": ModelSpec(131072, 8192, 0.05, 0.08, **_LLAMA3),
+    "llama-guard-3-8b": ModelSpec(8192, 8192, 0.20, 0.20, **_LLAMA3),
+    "mixtral-8x7b-32768": ModelSpec(32768, 32768, 0.24, 0.24, **_MIXTRAL),
+    "gemma2-9b-it": ModelSpec(8192, 8192, 0.20, 0.20, **_GEMINI),
+    "gemini-1.5-pro": ModelSpec(2097152, 8192, 1.25, 5.00, **_GEMINI),
+    "gemini-1.5-flash": ModelSpec(1048576, 8192, 0.075, 0.30, **_GEMINI),
+    "gemini-1.5-flash-8b": ModelSpec(1048576, 8192, 0.0375, 0.15, **_GEMINI),
+}
+
+# Conservative fallback for models not listed above.
+DEFAULT_SPEC = ModelSpec(8192, 4096, 1.00, 3.00)
+
+# Roughly what the old fixed truncation spent per call (8k chars of document plus up to five
+# 300-char citations). Raising it lets more of a long document through at proportional cost.
+DEFAULT_INPUT_BUDGET = 2500
+DEFAULT_OUTPUT_BUDGET = 2048
+CITATION_SHARE = 0.3
+MAX_CITATION_TOKENS = 150
+MAX_CHUNK_TOKENS = 200
+_GAP = "[…]"
+
+_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+|_+|[^\w\s]")
+_PLACEHOLDER_RUN_RE = re.compile(r"([_.\-])\1{3,}")
+_PAGE_FURNITURE_RE = re.compile(
+    r"^(page \d+( of \d+)?|this page (is )?intentionally left blank)$",
+    re.IGNORECASE,
+)
+# Execution fields repeat once per signatory and show whether a block was filled in,
+# so they are never dropped as duplicates.
+_FIELD_RE = re.compile(
+    r"^(\[?signature\]?|signed|name|date|title|witness|director|for and on behalf of)\b|^[_.\-\s]+$",
+    re.IGNORECASE,
+)
+_KEYWORDS = (
+    "adgm", "abu dhabi global market", "jurisdiction", "court", "governing law", "dubai",
+    "federal", "arbitration", "dispute", "signature", "signed", "execute", "director",
+    "shareholder", "share capital", "registered office", "beneficial owner", "ubo",
+    "liability", "resolution", "incorporat", "article", "clause", "shall", "must",
+)
+
+
+def get_spec(model: str) -> ModelSpec:
+    """Look up a model spec, accepting Gemini's ``models/`` prefix."""
+    name = model.split("/", 1)[1] if model.startswith("models/") else model
+    return MODEL_SPECS.get(name, DEFAULT_SPEC)
+
+
+def _piece_tokens(piece: str, spec: ModelSpec) -> int:
+    if piece.isdigit():
+        return math.ceil(len(piece) / spec.digits_per_token)
+    if piece[0].isalpha() or piece[0] == "_":
+        return math.ceil(len(piece) / spec.word_chars)
+    return 1
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """Approximate the token count of ``text`` locally without calling the provider.
+
+    This is a calibrated estimate, not the model's real tokenizer: words cost one token per
+    ``word_chars`` characters, digit runs are grouped per the tokenizer, punctuation costs one.
+    """
+    spec = get_spec(model)
+    return sum(_piece_tokens(t, spec) for t in _TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "") -> str:
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    spec = get_spec(model)
+    used = 0
+    end = 0
+    for m in _TOKEN_RE.finditer(text):
+        cost = _piece_tokens(m.group(), spec)
+        if used + cost > max_tokens - 1:
+            break
+        used += cost
+        end = m.end()
+    return text[:end].rstrip() + "…"
+
+
+def _shingles(text: str, n: int = 5) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < n:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def dedupe_citations(citations: List[Dict[str, str]], threshold: float = 0.6) -> List[Dict[str, str]]:
+    """Drop citations whose snippet mostly overlaps one already kept.
+
+    Input order is preserved, so callers should pass citations ranked by relevance.
+    """
+    kept: List[Dict[str, str]] = []
+    kept_shingles: List[set] = []
+    for c in citations:
+        sh = _shingles(c.get("snippet", ""))
+        if not sh:
+            continue
+        duplicate = False
+        for other in kept_shingles:
+            overlap = len(sh & other)
+            # containment catches a short snippet that sits inside a longer one
+            if overlap / min(len(sh), len(other)) >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(c)
+            kept_shingles.append(sh)
+    return kept
+
+
+def compress_section(section: str, seen_lines: set) -> str:
+    """Strip boilerplate from a section: blank lines, page furniture and repeated lines.
+
+    Signature and execution fields are kept, with placeholder runs shortened to three
+    characters, so the model can still tell an unfilled block from a completed one.
+    """
+    out: List[str] = []
+    for raw in section.splitlines():
+        line = _PLACEHOLDER_RUN_RE.sub(r"\1\1\1", " ".join(raw.split()))
+        if not line or _PAGE_FURNITURE_RE.match(line):
+            continue
+        key = line.lower()
+        if not _FIELD_RE.match(line):
+            if key in seen_lines:
+                continue
+            seen_lines.add(key)
+        out.append(line)
+    return "\n".join(out)
+
+
+def _chunk(section: str, model: str) -> List[str]:
+    """Split an oversized section on line boundaries so ranking works on headingless documents."""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in section.splitlines():
+        n = count_tokens(line, model)
+        if current and size + n > MAX_CHUNK_TOKENS:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += n
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _relevance(chunk: str, query_terms: set) -> float:
+    lowered = chunk.lower()
+    hits = sum(lowered.count(k) for k in _KEYWORDS)
+    overlap = len(set(re.findall(r"\w{4,}", lowered)) & query_terms)
+    return (2 * hits + overlap) / math.sqrt(max(1, len(lowered.split())))
+
+
+@dataclass
+class BuiltPrompt:
+    system: str
+    user: str
+    model: str
+    input_tokens: int
+    input_budget: int
+    max_output_tokens: int
+    sections_kept: int = 0
+    sections_total: int = 0
+    citations_kept: int = 0
+    citations_total: int = 0
+
+
+def build_prompt(
+    text: str,
+    citations: List[Dict[str, str]] | None = None,
+    model: str = "",
+    max_input_tokens: int = DEFAULT_INPUT_BUDGET,
+    max_output_tokens: int = DEFAULT_OUTPUT_BUDGET,
+) -> BuiltPrompt:
+    """Assemble the analysis prompt within the model's token budget.
+
+    The system prompt is returned separately so providers can take it as a system instruction.
+    It is too short for provider prompt caching to apply, and each document is sent once,
+    so no cached-token pricing is assumed.
+    Citations are deduplicated and capped at a share of the budget; the document is compressed
+    and its most relevant sections fill the remainder, emitted in their original order.
+    """
+    spec = get_spec(model)
+    max_output_tokens = min(max_output_tokens, spec.max_output_tokens)
+    budget = min(max_input_tokens, spec.context_window - max_output_tokens)
+    citations = citations or []
+
+    header = "Document text (most relevant sections):\n"
+    footer = "\n\nRespond with JSON only."
+    cite_header = "\n\nCitations:\n"
+    remaining = budget - count_tokens(SYSTEM_PROMPT + header + footer + cite_header, model)
+
+    # Citations first, limited to their share; unused share flows back to the document.
+    unique = dedupe_citations(citations)
+    cite_budget = int(remaining * CITATION_SHARE)
+    cite_lines: List[str] = []
+    for c in unique:
+        snippet = truncate_to_tokens(" ".join(c.get("snippet", "").split()), MAX_CITATION_TOKENS, model)
+        line = f"- Source: {c.get('source', '')}\n  Snippet: {snippet}"
+        n = count_tokens(line, model)
+        if n > cite_budget:
+            break
+        cite_lines.append(line)
+        cite_budget -= n
+    cite_block = "\n".join(cite_lines)
+    remaining -= count_tokens(cite_block, model)
+
+    seen: set = set()
+    chunks: List[str] = []
+    sections = split_into_sections(text)
+    for section in sections:
+        compressed = compress_section(section, seen)
+        if compressed:
+            chunks.extend(_chunk(compressed, model))
+
+    query_terms = set(re.findall(r"\w{4,}", " ".join(c.get("snippet", "") for c in unique).lower()))
+    # the opening chunk usually names the document type and parties, so always rank it first
+    ranked: List[Tuple[float, int]] = sorted(
+        (-(float("inf") if i == 0 else _relevance(ch, query_terms)), i) for i, ch in enumerate(chunks)
+    )
+    # Each kept chunk may be preceded by a gap marker, and one may trail the last chunk.
+    gap = count_tokens(_GAP, model)
+    remaining -= gap
+    selected: Dict[int, str] = {}
+    for _, i in ranked:
+        if remaining <= gap:
+            break
+        n = count_tokens(chunks[i], model) + gap
+        if n <= remaining:
+            selected[i] = chunks[i]
+            remaining -= n
+        elif remaining - gap > 50:
+            selected[i] = truncate_to_tokens(chunks[i], remaining - gap, model)
+            remaining = 0
+
+    parts: List[str] = []
+    last = -1
+    for i in sorted(selected):
+        if i != last + 1:
+            parts.append(_GAP)
+        parts.append(selected[i])
+        last = i
+    if chunks and last != len(chunks) - 1:
+        parts.append(_GAP)
+
+    user = header + "\n".join(parts)
+    if cite_block:
+        user += cite_header + cite_block
+    user += footer
+    return BuiltPrompt(
+        system=SYSTEM_PROMPT,
+        user=user,
+        model=model,
+        input_tokens=count_tokens(SYSTEM_PROMPT, model) + count_tokens(user, model),
+        input_budget=budget,
+        max_output_tokens=max_output_tokens,
+        sections_kept=len(selected),
+        sections_total=len(chunks),
+        citations_kept=len(cite_lines),
+        citations_total=len(citations),
+    )
+
+
+@dataclass
+class UsageRecord:
+    provider: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    estimated_input_tokens: int = 0
+    cost_usd: float = 0.0
+    latency_s: float = 0.0
+    timestamp: float = field(default_factory=time.time)
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    spec = get_spec(model)
+    return (input_tokens * spec.input_price + output_tokens * spec.output_price) / 1_000_000
+
+
+def record_usage(
+    provider: str,
+    prompt: BuiltPrompt,
+    input_tokens: Optional[int],
+    output_tokens: Optional[int],
+    latency_s: float = 0.0,
+    usage: List[UsageRecord] | None = None,
+) -> UsageRecord:
+    """Build the usage record for one LLM call and append it to ``usage`` if given.
+
+    Falls back to local estimates when the provider omits usage.
+    """
+    in_tok = input_tokens if input_tokens is not None else prompt.input_tokens
+    out_tok = output_tokens or 0
+    rec = UsageRecord(
+        provider=provider,
+        model=prompt.model,
+        input_tokens=in_tok,
+        output_tokens=out_tok,
+        estimated_input_tokens=prompt.input_tokens,
+        cost_usd=estimate_cost(prompt.model, in_tok, out_tok),
+        latency_s=latency_s,
+    )
+    if usage is not None:
+        usage.append(rec)
+    return rec
+
+
+def usage_summary(recs: List[UsageRecord]) -> Dict[str, Any]:
+    return {
+        "calls": len(recs),
+        "input_tokens": sum(r.input_tokens for r in recs),
+        "output_tokens": sum(r.output_tokens for r in recs),
+        "estimated_cost_usd": round(sum(r.cost_usd for r in recs), 6),
+        "per_call": [asdict(r) for r in recs],
+    }
@@ -0,0 +1,106 @@
+from src.prompt_builder import (
+    build_prompt,
+    count_tokens,
+    dedupe_citations,
+    estimate_cost,
+    record_usage,
+    usage_summary,
+)
+
+
+MODEL = "llama-3.3-70b-versatile"
+
+
+def _long_doc(n_clauses: int = 200) -> str:
+    clauses = "\n".join(
+        f"Clause {i}\nThis clause covers general matters number {i} with ordinary filler text."
+        for i in range(n_clauses)
+    )
+    return (
+        "ARTICLES OF ASSOCIATION\nThe company is ABC Holdings Ltd.\n"
+        + clauses
+        + "\nJURISDICTION\nThe courts of Dubai shall have jurisdiction over disputes.\n"
+    )
+
+
+def test_budget_never_exceeded():
+    cites = [{"source": f"s{i}", "snippet": f"Reference {i} on ADGM registered office rules " * 10} for i in range(5)]
+    for budget in (300, 800, 2500):
+        for model in (MODEL, "models/gemini-1.5-pro", "unknown-model"):
+            p = build_prompt(_long_doc(), cites, model=model, max_input_tokens=budget)
+            assert p.input_tokens <= p.input_budget == budget
+            assert count_tokens(p.system, model) + count_tokens(p.user, model) == p.input_tokens
+
+
+def test_first_chunk_always_kept():
+    p = build_prompt(_long_doc(), model=MODEL, max_input_tokens=400)
+    assert "ARTICLES OF ASSOCIATION" in p.user
+    assert p.sections_kept < p.sections_total
+
+
+def test_relevant_section_preferred_over_filler():
+    p = build_prompt(_long_doc(), model=MODEL, max_input_tokens=400)
+    assert "courts of Dubai" in p.user
+    assert "[…]" in p.user
+
+
+def test_near_duplicate_citations_dropped():
+    base = "ADGM Courts have exclusive jurisdiction over companies incorporated in the ADGM"
+    cites = [
+        {"source": "a", "snippet": base + " and its free zone."},
+        {"source": "b", "snippet": base},
+        {"source": "c", "snippet": "The registered office must be located within ADGM."},
+    ]
+    assert [c["source"] for c in dedupe_citations(cites)] == ["a", "c"]
+    p = build_prompt("MEMORANDUM\nText.", cites, model=MODEL)
+    assert p.citations_kept == 2
+    assert p.citations_total == 3
+
+
+def test_signature_fields_preserved():
+    doc = (
+        "BOARD RESOLUTION\nThe board resolves to incorporate.\nPage 1 of 2\n"
+        "SIGNATURES\nSignature:\n____________\nName:\nDate:\n"
+        "Signature:\n____________\nName: Jane Doe\nDate: 1 May 2024\n"
+        "This page intentionally left blank"
+    )
+    user = build_prompt(doc, model=MODEL).user
+    assert user.count("Signature:") == 2
+    assert user.count("___") == 2
+    assert "Name:\nDate:" in user
+    assert "Name: Jane Doe" in user
+    assert "Page 1 of 2" not in user
+    assert "intentionally left blank" not in user
+
+
+def test_record_usage_falls_back_to_estimates():
+    p = build_prompt("ARTICLES OF ASSOCIATION\nThe company is ABC Ltd.", model=MODEL)
+    usage = []
+    rec = record_usage("groq", p, None, None, usage=usage)
+    assert usage == [rec]
+    assert rec.input_tokens == rec.estimated_input_tokens == p.input_tokens
+    assert rec.output_tokens == 0
+    assert rec.cost_usd == estimate_cost(MODEL, p.input_tokens, 0)
+
+
+def test_record_usage_prefers_provider_counts():
+    p = build_prompt("ARTICLES OF ASSOCIATION", model=MODEL)
+    usage = []
+    record_usage("groq", p, 1000, 200, usage=usage)
+    record_usage("groq", p, 500, 100, usage=usage)
+    summary = usage_summary(usage)
+    assert summary["calls"] == 2
+    assert summary["input_tokens"] == 1500
+    assert summary["output_tokens"] == 300
+    assert summary["estimated_cost_usd"] == round((1500 * 0.59 + 300 * 0.79) / 1_000_000, 6)
+
+
+def test_budget_counts_gap_markers_between_scattered_sections():
+    # every other clause is relevant, so the selection is full of gaps
+    doc = "TITLE\n" + "\n".join(
+        (f"CLAUSE {i}\nThe ADGM courts shall have jurisdiction." if i % 2 else f"CLAUSE {i}\nFiller text {i}.")
+        for i in range(300)
+    )
+    for budget in range(200, 1200, 37):
+        p = build_prompt(doc, model=MODEL, max_input_tokens=budget)
+        assert p.input_tokens <= budget